@@ -0,0 +1,84 @@
+"""
+yt-dlp 추출 결과 정리 및 프로세스 풀 워커용 추출 함수
+EXTRACT_PROCESSES를 지정하면 yt-dlp의 JS 인터프리터/서명 해독(CPU 작업)을
+GIL을 피해 별도 프로세스에서 실행
+"""
+
+from itertools import islice
+from typing import Dict, Any
+
+import yt_dlp
+
+# 워커 프로세스별로 재사용하는 YoutubeDL 인스턴스 (옵션 프로필별)
+_YDL_INSTANCES: Dict[str, "yt_dlp.YoutubeDL"] = {}
+
+def _get_ydl(opts: Dict[str, Any]) -> "yt_dlp.YoutubeDL":
+    key = repr(sorted(opts.items()))
+    ydl = _YDL_INSTANCES.get(key)
+    if ydl is None:
+        ydl = _YDL_INSTANCES[key] = yt_dlp.YoutubeDL(opts)
+    return ydl
+
+def _is_viewable(fmt: Dict[str, Any]) -> bool:
+    """영상 트랙이 있고 URL이 있는 포맷인지 확인"""
+    return fmt.get('vcodec') != 'none' and bool(fmt.get('url'))
+
+def warm_up(opts: Dict[str, Any]) -> bool:
+    """워커 프로세스의 YoutubeDL 인스턴스를 미리 생성"""
+    _get_ydl(opts)
+    return True
+
+def run_extract(url: str, opts: Dict[str, Any]) -> Dict[str, Any]:
+    """비디오 정보 및 실제 다운로드 URL 추출 (피클 가능한 dict 반환)"""
+    try:
+        info = _get_ydl(opts).extract_info(url, download=False)
+    except Exception as e:
+        # yt-dlp 예외는 피클이 보장되지 않으므로 메시지만 전달
+        _YDL_INSTANCES.pop(repr(sorted(opts.items())), None)
+        raise RuntimeError(str(e)) from None
+    return summarize_info(info)
+
+def summarize_info(info: Dict[str, Any]) -> Dict[str, Any]:
+    """yt-dlp 정보에서 응답용 필드와 실제 다운로드 URL만 추림"""
+    formats = info.get('formats') or ()
+    
+    # 포맷 정보 정리 (사용자에게 보여줄 용도, 유효한 포맷 상위 5개만)
+    processed_formats = [
+        {
+            "format_id": fmt.get('format_id', ''),
+            "ext": fmt.get('ext', ''),
+            "height": fmt.get('height'),
+            "filesize": fmt.get('filesize'),
+            "note": fmt.get('format_note', '')
+        }
+        for fmt in islice(filter(_is_viewable, formats), 5)
+    ]
+    
+    # 선택된 포맷 찾기 (yt-dlp가 자동으로 선택한 최적 포맷)
+    download_url = info.get('url') or ""
+    selected_format = None
+    
+    if not download_url:
+        # formats에서 mp4 포맷 찾기 (백업용), 못 찾으면 다른 형식이라도
+        selected_format = next(
+            (fmt for fmt in formats
+             if fmt.get('ext') == 'mp4' and fmt.get('url') and (fmt.get('height') or 0) <= 720),
+            None
+        ) or next(
+            (fmt for fmt in formats
+             if _is_viewable(fmt) and (fmt.get('height') or 0) <= 720),
+            None
+        )
+        if selected_format:
+            download_url = selected_format['url']
+    
+    return {
+        "title": info.get('title', 'Unknown Title'),
+        "duration": info.get('duration'),
+        "view_count": info.get('view_count'),
+        "uploader": info.get('uploader', 'Unknown'),
+        "formats": processed_formats,
+        "url": download_url,  # 실제 다운로드 가능한 URL
+        "direct_url": download_url,  # 명시적으로 다운로드 URL
+        "selected_format": selected_format.get('format_note', 'auto') if selected_format else 'auto'
+    }
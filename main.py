@@ -6,18 +6,36 @@ Railway 프로덕션용 yt-dlp FastAPI 서버
 
 import os
 import time
+import asyncio
 import logging
-from typing import Optional, Dict, Any
+import random
+import queue
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager, contextmanager
+from threading import Lock
+from typing import Optional, Dict, Any, AsyncIterator, Iterator, List, Tuple
 
-from fastapi import FastAPI, HTTPException
+from blake3 import blake3
+from cachetools import TTLCache
+from diskcache import Cache
+
+import httpx
+import orjson
+import redis.asyncio as aioredis
+from redis.exceptions import RedisError
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse
-from pydantic import BaseModel, HttpUrl
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, ConfigDict, Field, HttpUrl
 import uvicorn
 
 # yt-dlp import
 try:
     import yt_dlp
+    from extractor import run_extract, summarize_info, warm_up
     YT_DLP_AVAILABLE = True
     print("✅ yt-dlp successfully imported")
 except ImportError:
@@ -25,14 +43,211 @@ except ImportError:
     print("❌ yt-dlp not available - falling back to mock mode")
 
 # 로깅 설정
-logging.basicConfig(level=logging.INFO)
+# 로그 레벨은 LOG_LEVEL로 조정 (프로덕션 기본값 WARNING)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING").upper())
 logger = logging.getLogger(__name__)
 
+# 샘플링된 액세스 로그 (uvicorn 액세스 로그 대신, 0이면 비활성화)
+_ACCESS_LOG_SAMPLE_RATE = float(os.getenv("ACCESS_LOG_SAMPLE_RATE", "0.01"))
+access_logger = logging.getLogger(f"{__name__}.access")
+access_logger.setLevel(logging.INFO)
+
+def _url_hash(url: str) -> str:
+    """URL의 짧은 BLAKE3 해시 (캐시 키, 파일명용)"""
+    return blake3(url.encode()).hexdigest(8)
+
+# 메타데이터 캐시 (URL 해시 키, 반복 요청 시 yt-dlp 호출 생략)
+_INFO_CACHE: TTLCache = TTLCache(maxsize=2048, ttl=600)
+# 스트림 URL 캐시 (서명된 URL은 만료되므로 TTL을 짧게)
+_STREAM_CACHE: TTLCache = TTLCache(maxsize=2048, ttl=300)
+# /test-stream 응답 캐시 (반복 프로브 차단)
+_TEST_STREAM_CACHE: TTLCache = TTLCache(maxsize=1, ttl=60)
+# TTLCache는 스레드 안전하지 않음
+_CACHE_LOCK = Lock()
+
+# 프로세스/연결 자원은 import 시점이 아니라 lifespan에서 생성
+# (추출 자식 프로세스가 main.py를 __mp_main__으로 다시 import해도 만들어지지 않도록)
+
+# 재배포 후에도 유지되고 워커 간에 공유되는 디스크 메타데이터 캐시
+_DCACHE_DIR = os.getenv("YTDLP_CACHE_DIR", "/tmp/ytdlp-cache")
+_DCACHE_SIZE_LIMIT = int(1e9)
+_DCACHE: Optional[Cache] = None
+_DCACHE_EXPIRE = 86400
+_DCACHE_KEY_PREFIX = "info:"
+# 디스크 캐시 적중/미스 수 (diskcache 내장 통계는 조회마다 SQLite 쓰기가 생기므로 워커별로 직접 집계)
+_DCACHE_COUNTS = {"hits": 0, "misses": 0}
+
+# 여러 워커/인스턴스가 공유하는 Redis 메타데이터 캐시 (REDIS_URL 설정 시에만 사용)
+# Redis 장애 시에는 프로세스/디스크 캐시만으로 동작
+_REDIS_URL = os.getenv("REDIS_URL")
+_REDIS: Optional["aioredis.Redis"] = None
+_REDIS_KEY_PREFIX = "ytinfo:"
+_REDIS_TTL = 600
+# Redis 오류 후 잠시 Redis를 건너뛰어 요청마다 타임아웃을 기다리지 않도록
+_REDIS_COOLDOWN = 5.0
+_redis_retry_at = 0.0
+
+class YoutubeDLPool:
+    """옵션 프로필별 YoutubeDL 인스턴스 풀
+
+    YoutubeDL은 스레드 안전하지 않으므로 인스턴스 하나를 한 요청만 사용하도록
+    빌려주고 반납받는다. 인스턴스를 재사용하면 extractor 초기화와
+    TCP/TLS 연결을 요청마다 다시 만들지 않아도 된다.
+    """
+
+    def __init__(self, opts: Dict[str, Any], size: int = 4):
+        self.opts = opts
+        self._idle: "queue.Queue" = queue.Queue(maxsize=size)
+
+    @contextmanager
+    def acquire(self) -> Iterator["yt_dlp.YoutubeDL"]:
+        try:
+            ydl = self._idle.get_nowait()
+        except queue.Empty:
+            ydl = yt_dlp.YoutubeDL(self.opts)
+        
+        try:
+            yield ydl
+        except Exception:
+            # 오류 후 상태가 불확실한 인스턴스는 버림
+            ydl.close()
+            raise
+        
+        try:
+            self._idle.put_nowait(ydl)
+        except queue.Full:
+            ydl.close()
+
+# 추출 속도 최적화 옵션 (DASH/HLS 매니페스트 요청 생략)
+_FAST_EXTRACT_OPTS = {
+    'youtube_include_dash_manifest': False,
+    'youtube_include_hls_manifest': False,
+    'extract_flat': 'in_playlist',
+}
+
+# 플레이어 클라이언트 고정은 YTDLP_PLAYER_CLIENT를 지정한 경우에만 (예: "ios,web")
+# 설치된 yt-dlp가 지원하지 않는 클라이언트는 무시되고 기본 클라이언트가 사용됨
+_YOUTUBE_PLAYER_CLIENT = os.getenv("YTDLP_PLAYER_CLIENT")
+if _YOUTUBE_PLAYER_CLIENT:
+    _FAST_EXTRACT_OPTS['extractor_args'] = {
+        'youtube': {'player_client': _YOUTUBE_PLAYER_CLIENT.split(",")}
+    }
+
+# 실제 다운로드 가능한 비디오 포맷 선택 (720p 이하, mp4 우선)
+_YDL_OPTS_EXTRACT = {
+    'quiet': True,
+    'no_warnings': True,
+    'format': '(mp4)[height<=720]/best[height<=720]/best',
+    'noplaylist': True,
+    'skip_download': True,
+    **_FAST_EXTRACT_OPTS,
+}
+
+# 최적화된 yt-dlp 옵션 (빠른 추출을 위해)
+_YDL_OPTS_STREAM = {
+    'quiet': True,
+    'no_warnings': True,
+    'format': 'worst[height<=480]/worst',  # 빠른 추출을 위해 낮은 품질 먼저 시도
+    'noplaylist': True,
+    'no_check_certificate': True,
+    'socket_timeout': 10,  # 10초 타임아웃
+    **_FAST_EXTRACT_OPTS,
+}
+
+_YDL_OPTS_TEST = {
+    'quiet': True,
+    'no_warnings': True,
+    'format': 'best[height<=480][ext=mp4]/best[height<=480]',
+    'noplaylist': True,
+}
+
+_YDL_EXTRACT = YoutubeDLPool(_YDL_OPTS_EXTRACT, size=8)
+_YDL_STREAM = YoutubeDLPool(_YDL_OPTS_STREAM)
+_YDL_TEST = YoutubeDLPool(_YDL_OPTS_TEST, size=1)
+
+# Railway 프록시 다운로드 URL (배포 호스트가 바뀌면 PROXY_BASE_URL로 지정)
+_PROXY_BASE_URL = os.getenv(
+    "PROXY_BASE_URL",
+    "https://railway-ytdlp-fresh-railway-ytdlp-fresh.up.railway.app"
+).rstrip("/")
+_PROXY_STREAM_PREFIX = f"{_PROXY_BASE_URL}/stream?url="
+_TEST_STREAM_URL = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+_DEBUG_ROUTES_ENABLED = os.getenv("ENABLE_DEBUG_ROUTES") == "1"
+
+# /extract 응답의 HTTP 캐시 정책 (서버 메타데이터 캐시 TTL과 동일)
+_EXTRACT_CACHE_CONTROL = "public, max-age=600"
+
+# 블로킹 yt-dlp 호출 전용 스레드 풀 (이벤트 루프 차단 방지)
+_EXTRACT_POOL = ThreadPoolExecutor(max_workers=16, thread_name_prefix="ytdlp")
+
+# uvicorn 워커 수 (2n+1, WEB_CONCURRENCY로 조정 가능)
+_WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", (os.cpu_count() or 1) * 2 + 1))
+
+# /extract 전용 프로세스 풀 (선택 사항, EXTRACT_PROCESSES > 0일 때만 사용)
+# 기본값은 스레드 풀 추출: 추출 시간 대부분이 네트워크 대기라 스레드로도 충분히 병렬화됨
+# 프로세스 하나는 한 번에 추출 하나만 처리하므로 워커당 동시 추출 수 = EXTRACT_PROCESSES
+# (배치 동시 실행 수 8 이상 권장), 워커마다 풀을 따로 두므로 전체 프로세스 수는 워커 수 x EXTRACT_PROCESSES
+_EXTRACT_PROCESSES = int(os.getenv("EXTRACT_PROCESSES", "0"))
+# 실행 중인 uvloop 워커를 fork하지 않도록 forkserver에서 자식 프로세스 생성
+_MP_CONTEXT = multiprocessing.get_context("forkserver")
+_MP_CONTEXT.set_forkserver_preload(["extractor"])
+
+def _new_process_pool() -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=_EXTRACT_PROCESSES, mp_context=_MP_CONTEXT)
+
+_PROC: Optional[ProcessPoolExecutor] = None
+
+# 배치 요청의 동시 추출 수 제한 (YouTube 과호출 방지)
+_BATCH_SEMAPHORE = asyncio.Semaphore(8)
+# 한 배치 요청이 세마포어를 오래 독점하지 않도록 URL 개수 제한 (초과 시 422)
+_BATCH_MAX_URLS = 50
+
+# 업스트림 비디오 프록시용 HTTP 클라이언트 (HTTP/2 연결 풀 재사용)
+_HTTP: Optional[httpx.AsyncClient] = None
+_STREAM_CHUNK_SIZE = 1 << 16
+
+# 클라이언트로 그대로 전달할 업스트림 응답 헤더
+_PASSTHROUGH_HEADERS = ("content-length", "content-range", "accept-ranges")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """워커별 캐시/연결/프로세스 풀 생성 및 예열, 종료 시 정리"""
+    global _DCACHE, _HTTP, _REDIS, _PROC
+    _DCACHE = Cache(_DCACHE_DIR, size_limit=_DCACHE_SIZE_LIMIT)
+    _HTTP = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+        # 연결/풀 대기는 짧게, 청크 간 읽기는 넉넉하게 (응답 없는 업스트림이 연결을 붙잡지 않도록)
+        timeout=httpx.Timeout(10.0, read=30.0, pool=5.0)
+    )
+    if _REDIS_URL:
+        _REDIS = aioredis.from_url(
+            _REDIS_URL,
+            socket_connect_timeout=0.5,
+            socket_timeout=0.5
+        )
+    if YT_DLP_AVAILABLE and _EXTRACT_PROCESSES > 0:
+        _PROC = _new_process_pool()
+        # 프로세스 풀 워커를 미리 띄우고 YoutubeDL 인스턴스 생성
+        for _ in range(_EXTRACT_PROCESSES):
+            _PROC.submit(warm_up, _YDL_OPTS_EXTRACT)
+    
+    yield
+    
+    if _PROC is not None:
+        _PROC.shutdown(wait=False, cancel_futures=True)
+    await _HTTP.aclose()
+    if _REDIS is not None:
+        await _REDIS.aclose()
+    _DCACHE.close()
+
 # FastAPI 앱
 app = FastAPI(
+    lifespan=lifespan,
     title="Railway yt-dlp API Server - Fresh Deploy",
     description="Production yt-dlp video extraction service for LinkFetch",
-    version="3.0.0"
+    version="3.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # CORS 설정
@@ -44,13 +259,103 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+class SampledAccessLogMiddleware:
+    """일부 요청만 샘플링하여 액세스 로그 기록
+
+    순수 ASGI 미들웨어라서 샘플링되지 않은 요청은 추가 비용 없이 그대로 통과하고,
+    샘플링된 요청도 send만 감싸므로 스트리밍 응답 본문을 다시 버퍼링하지 않는다.
+    """
+
+    def __init__(self, app, sample_rate: float):
+        self.app = app
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or random.random() >= self.sample_rate:
+            await self.app(scope, receive, send)
+            return
+        
+        started = time.perf_counter()
+        status_code = 500
+        
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            access_logger.info(
+                "%s %s %d %.1fms",
+                scope["method"], scope["path"], status_code,
+                (time.perf_counter() - started) * 1000
+            )
+
+if _ACCESS_LOG_SAMPLE_RATE > 0:
+    app.add_middleware(SampledAccessLogMiddleware, sample_rate=_ACCESS_LOG_SAMPLE_RATE)
+
 # 요청 모델
 class VideoRequest(BaseModel):
+    model_config = ConfigDict(str_strip_whitespace=True, frozen=True)
+    
     url: HttpUrl
     quality: Optional[str] = "best"
 
-def extract_video_info(url: str) -> Dict[str, Any]:
-    """yt-dlp를 사용하여 비디오 정보 및 실제 다운로드 URL 추출"""
+class BatchRequest(BaseModel):
+    model_config = ConfigDict(str_strip_whitespace=True, frozen=True)
+    
+    urls: List[HttpUrl] = Field(max_length=_BATCH_MAX_URLS)
+
+def _disk_cache_get(key: str) -> Optional[Dict[str, Any]]:
+    """디스크 캐시 조회 및 적중/미스 집계 (스레드 풀에서 실행)"""
+    video_data = _DCACHE.get(_DCACHE_KEY_PREFIX + key)
+    with _CACHE_LOCK:
+        _DCACHE_COUNTS["hits" if video_data is not None else "misses"] += 1
+    return video_data
+
+def _disk_cache_set(key: str, video_data: Dict[str, Any]) -> None:
+    _DCACHE.set(_DCACHE_KEY_PREFIX + key, video_data, expire=_DCACHE_EXPIRE)
+
+async def extract_video_info(url: str, key: str) -> Dict[str, Any]:
+    """디스크 캐시 확인 후 yt-dlp로 비디오 정보 및 실제 다운로드 URL 추출 (메모리 캐시에 저장)"""
+    loop = asyncio.get_running_loop()
+    video_data = await loop.run_in_executor(_EXTRACT_POOL, _disk_cache_get, key)
+    if video_data is None:
+        video_data = await _extract_video_info_uncached(url)
+        await loop.run_in_executor(_EXTRACT_POOL, _disk_cache_set, key, video_data)
+    
+    with _CACHE_LOCK:
+        _INFO_CACHE[key] = video_data
+    return video_data
+
+def _extract_in_thread(url: str) -> Dict[str, Any]:
+    """스레드 풀에서 실행하는 추출 (풀에서 빌린 YoutubeDL 사용)"""
+    with _YDL_EXTRACT.acquire() as ydl:
+        info = ydl.extract_info(url, download=False)
+    return summarize_info(info)
+
+async def _run_in_process_pool(fn, *args):
+    """프로세스 풀에서 실행하고 결과를 기다림 (스레드를 점유하지 않음)
+
+    자식 프로세스가 죽어 풀이 깨지면 (OOM kill 등) 다음 요청을 위해 풀만 새로 만들고,
+    실행 중이던 요청은 재시도하지 않는다 (같은 URL이 매번 자식을 죽이는 경우 대비).
+    """
+    global _PROC
+    proc = _PROC
+    try:
+        return await asyncio.wrap_future(proc.submit(fn, *args))
+    except BrokenProcessPool:
+        # 이벤트 루프에서만 실행되므로 이미 다른 요청이 교체했는지만 확인
+        if _PROC is proc:
+            logger.warning("Extraction process pool broken, recreating")
+            proc.shutdown(wait=False, cancel_futures=True)
+            _PROC = _new_process_pool()
+        raise
+
+async def _extract_video_info_uncached(url: str) -> Dict[str, Any]:
+    """캐시 없이 yt-dlp로 직접 추출"""
     if not YT_DLP_AVAILABLE:
         # Mock 데이터 반환
         return {
@@ -67,73 +372,56 @@ def extract_video_info(url: str) -> Dict[str, Any]:
         }
     
     try:
-        # 실제 다운로드 가능한 비디오 포맷 선택 (720p 이하, mp4 우선)
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'format': '(mp4)[height<=720]/best[height<=720]/best',
-            'noplaylist': True,
-        }
+        if _PROC is not None:
+            # CPU 비중이 큰 yt-dlp 추출을 프로세스 풀에서 실행
+            return await _run_in_process_pool(run_extract, url, _YDL_OPTS_EXTRACT)
+        
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_EXTRACT_POOL, _extract_in_thread, url)
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            
-            # 실제 다운로드 가능한 URL 찾기
-            download_url = ""
-            selected_format = None
-            
-            # 선택된 포맷 찾기 (yt-dlp가 자동으로 선택한 최적 포맷)
-            if 'url' in info and info['url']:
-                download_url = info['url']
-                
-            # formats에서 mp4 포맷 찾기 (백업용)
-            if not download_url and 'formats' in info:
-                for fmt in info['formats']:
-                    if (fmt.get('ext') == 'mp4' and 
-                        fmt.get('height', 0) <= 720 and 
-                        fmt.get('url')):
-                        download_url = fmt['url']
-                        selected_format = fmt
-                        break
-                
-                # mp4를 못 찾았으면 다른 형식이라도
-                if not download_url:
-                    for fmt in info['formats']:
-                        if (fmt.get('height', 0) <= 720 and 
-                            fmt.get('url') and 
-                            fmt.get('vcodec') != 'none'):
-                            download_url = fmt['url']
-                            selected_format = fmt
-                            break
-            
-            # 포맷 정보 정리 (사용자에게 보여줄 용도)
-            processed_formats = []
-            if 'formats' in info:
-                for fmt in info['formats'][:5]:  # 상위 5개만
-                    if fmt.get('vcodec') != 'none' and fmt.get('url'):
-                        processed_formats.append({
-                            "format_id": fmt.get('format_id', ''),
-                            "ext": fmt.get('ext', ''),
-                            "height": fmt.get('height'),
-                            "filesize": fmt.get('filesize'),
-                            "note": fmt.get('format_note', '')
-                        })
-            
-            return {
-                "title": info.get('title', 'Unknown Title'),
-                "duration": info.get('duration'),
-                "view_count": info.get('view_count'),
-                "uploader": info.get('uploader', 'Unknown'),
-                "formats": processed_formats,
-                "url": download_url,  # 실제 다운로드 가능한 URL
-                "direct_url": download_url,  # 명시적으로 다운로드 URL
-                "selected_format": selected_format.get('format_note', 'auto') if selected_format else 'auto'
-            }
-            
     except Exception as e:
-        logger.error(f"yt-dlp extraction failed: {str(e)}")
+        logger.error("yt-dlp extraction failed: %s", e)
         raise HTTPException(status_code=500, detail=f"Video extraction failed: {str(e)}")
 
+def _redis_usable() -> bool:
+    return _REDIS is not None and time.monotonic() >= _redis_retry_at
+
+def _redis_failed(operation: str, error: Exception) -> None:
+    """Redis 오류 기록 후 일정 시간 Redis 사용 중지"""
+    global _redis_retry_at
+    _redis_retry_at = time.monotonic() + _REDIS_COOLDOWN
+    logger.warning("Redis %s failed, skipping Redis for %.0fs: %s", operation, _REDIS_COOLDOWN, error)
+
+async def get_video_data(url: str) -> Dict[str, Any]:
+    """프로세스 메모리 캐시, Redis 공유 캐시, 디스크 캐시 순으로 확인하고, 없으면 추출"""
+    url_hash = _url_hash(url)
+    with _CACHE_LOCK:
+        cached = _INFO_CACHE.get(url_hash)
+    if cached is not None:
+        return cached
+    
+    key = _REDIS_KEY_PREFIX + url_hash
+    if _redis_usable():
+        try:
+            cached = await _REDIS.get(key)
+        except RedisError as e:
+            _redis_failed("get", e)
+        else:
+            if cached:
+                video_data = orjson.loads(cached)
+                with _CACHE_LOCK:
+                    _INFO_CACHE[url_hash] = video_data
+                return video_data
+    
+    video_data = await extract_video_info(url, url_hash)
+    
+    if _redis_usable():
+        try:
+            await _REDIS.setex(key, _REDIS_TTL, orjson.dumps(video_data))
+        except RedisError as e:
+            _redis_failed("set", e)
+    return video_data
+
 @app.get("/")
 async def root():
     """메인 엔드포인트"""
@@ -157,18 +445,34 @@ async def health():
         "message": "✅ Railway yt-dlp API Server (Fresh Deploy) 정상 동작 중"
     }
 
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match 헤더가 주어진 ETag와 일치하는지 확인"""
+    if not if_none_match:
+        return False
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag in candidates or "*" in candidates
+
 @app.post("/extract")
-async def extract_video(request: VideoRequest):
-    """비디오 정보 추출 (LinkFetch 호환)"""
+async def extract_video(request: VideoRequest, http_request: Request, response: Response):
+    """비디오 정보 추출 (LinkFetch 호환, ETag 지원)"""
     try:
         url = str(request.url)
-        logger.info(f"📹 Extracting video info: {url}")
+        logger.info("Extracting video info: %s", url)
+        
+        video_data = await get_video_data(url)
         
-        video_data = extract_video_info(url)
+        # 같은 영상을 다시 요청하는 클라이언트는 본문 없이 304로 응답
+        etag = f'"{_url_hash(url + video_data["title"])}"'
+        if _etag_matches(http_request.headers.get("if-none-match"), etag):
+            return Response(
+                status_code=304,
+                headers={"ETag": etag, "Cache-Control": _EXTRACT_CACHE_CONTROL}
+            )
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = _EXTRACT_CACHE_CONTROL
         
         # Railway 프록시 다운로드 URL 생성
-        base_url = "https://railway-ytdlp-fresh-railway-ytdlp-fresh.up.railway.app"
-        proxy_url = f"{base_url}/stream?url={url}"
+        proxy_url = _PROXY_STREAM_PREFIX + url
         
         return {
             "success": True,
@@ -189,13 +493,58 @@ async def extract_video(request: VideoRequest):
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Unexpected error: {str(e)}")
+        logger.error("Unexpected error: %s", e)
         return {
             "success": False,
             "error": str(e),
             "message": "Video extraction failed"
         }
 
+async def _extract_with_limit(url: str) -> Dict[str, Any]:
+    """세마포어로 동시 실행 수를 제한하여 추출"""
+    async with _BATCH_SEMAPHORE:
+        return await get_video_data(url)
+
+@app.post("/extract_batch")
+async def extract_video_batch(request: BatchRequest):
+    """여러 비디오 정보를 병렬로 추출"""
+    urls = [str(u) for u in request.urls]
+    logger.info("Extracting batch of %d videos", len(urls))
+    
+    results = await asyncio.gather(
+        *(_extract_with_limit(url) for url in urls),
+        return_exceptions=True
+    )
+    
+    items = []
+    for url, result in zip(urls, results):
+        if isinstance(result, BaseException):
+            items.append({
+                "url": url,
+                "success": False,
+                "error": getattr(result, "detail", None) or str(result)
+            })
+            continue
+        
+        proxy_url = _PROXY_STREAM_PREFIX + url
+        items.append({
+            "url": url,
+            "success": True,
+            "data": {
+                "video_info": {
+                    "title": result["title"],
+                    "duration": result.get("duration"),
+                    "view_count": result.get("view_count"),
+                    "uploader": result.get("uploader"),
+                    "formats": result.get("formats", [])
+                },
+                "download_url": proxy_url,
+                "selected_format": result.get("selected_format", "auto")
+            }
+        })
+    
+    return items
+
 @app.get("/status")
 async def server_status():
     """서버 상태 정보"""
@@ -209,104 +558,222 @@ async def server_status():
         }
     }
 
-@app.get("/test-stream")
+def _extract_test_info(url: str) -> Dict[str, Any]:
+    """스트리밍 테스트용 추출"""
+    with _YDL_TEST.acquire() as ydl:
+        return ydl.extract_info(url, download=False)
+
 async def test_stream():
-    """스트리밍 테스트 엔드포인트"""
-    test_url = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+    """스트리밍 테스트 엔드포인트 (ENABLE_DEBUG_ROUTES=1일 때만 등록)"""
+    with _CACHE_LOCK:
+        cached = _TEST_STREAM_CACHE.get("_test_stream_last")
+    if cached is not None:
+        return cached
     
     try:
         if not YT_DLP_AVAILABLE:
             return {"error": "yt-dlp not available"}
         
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'format': 'best[height<=480][ext=mp4]/best[height<=480]',
-            'noplaylist': True,
+        loop = asyncio.get_running_loop()
+        info = await loop.run_in_executor(_EXTRACT_POOL, _extract_test_info, _TEST_STREAM_URL)
+        
+        result = {
+            "status": "success",
+            "title": info.get('title'),
+            "has_url": bool(info.get('url')),
+            "url_preview": info.get('url', '')[:100] + "..." if info.get('url') else "No URL",
+            "format_selected": info.get('format_id'),
+            "ext": info.get('ext')
         }
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(test_url, download=False)
-            
-            return {
-                "status": "success",
-                "title": info.get('title'),
-                "has_url": bool(info.get('url')),
-                "url_preview": info.get('url', '')[:100] + "..." if info.get('url') else "No URL",
-                "format_selected": info.get('format_id'),
-                "ext": info.get('ext')
-            }
-            
     except Exception as e:
         return {"error": str(e)}
+    
+    # 반복 호출이 매번 외부 추출을 일으키지 않도록 짧게 캐시
+    with _CACHE_LOCK:
+        _TEST_STREAM_CACHE["_test_stream_last"] = result
+    return result
+
+# 하드코딩된 URL로 외부 추출을 일으키는 디버그 라우트는 명시적으로 켠 경우에만 노출
+if _DEBUG_ROUTES_ENABLED:
+    app.get("/test-stream")(test_stream)
+
+def resolve_stream_url(url: str, key: str) -> Tuple[str, str]:
+    """스트리밍 가능한 URL과 확장자 반환 (URL 해시 key로 TTL 캐시 적용)"""
+    with _CACHE_LOCK:
+        cached = _STREAM_CACHE.get(key)
+    if cached is not None:
+        logger.info("Stream URL cache hit")
+        return cached
+    
+    logger.info("Fast extracting with optimized yt-dlp...")
+    
+    with _YDL_STREAM.acquire() as ydl:
+        # 타임아웃 방지를 위한 빠른 추출
+        info = ydl.extract_info(url, download=False)
+    
+    # 스트리밍 가능한 URL 찾기 (선택된 포맷 URL이 있으면 formats는 확인하지 않음)
+    stream_url = info.get('url')
+    if stream_url:
+        logger.info("Fast stream URL found: %.50s...", stream_url)
+    else:
+        # 대안 URL 찾기 (처음 3개만 확인)
+        stream_url = next(
+            (fmt['url'] for fmt in (info.get('formats') or [])[:3] if fmt.get('url')),
+            None
+        )
+        if stream_url:
+            logger.info("Alternative stream URL found")
+    
+    if not stream_url:
+        logger.error("No streamable URL found")
+        raise HTTPException(status_code=404, detail="No streamable URL found for this video")
+    
+    resolved = (stream_url, info.get('ext', 'mp4'))
+    with _CACHE_LOCK:
+        _STREAM_CACHE[key] = resolved
+    return resolved
 
 @app.get("/stream")
-async def stream_video(url: str):
-    """비디오 스트리밍/다운로드 - Railway 서버가 프록시 역할 (최적화됨)"""
+async def stream_video(url: str, request: Request):
+    """비디오 스트리밍/다운로드 - Railway 서버가 바이트를 직접 중계하는 프록시"""
     try:
-        logger.info(f"🎬 Fast streaming request for: {url[:50]}...")
+        logger.info("Fast streaming request for: %.50s...", url)
         
         if not YT_DLP_AVAILABLE:
             logger.error("yt-dlp not available")
             raise HTTPException(status_code=503, detail="yt-dlp service not available")
         
-        # 최적화된 yt-dlp 옵션 (빠른 추출을 위해)
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'format': 'worst[height<=480]/worst',  # 빠른 추출을 위해 낮은 품질 먼저 시도
-            'noplaylist': True,
-            'extract_flat': False,
-            'no_check_certificate': True,
-            'socket_timeout': 10,  # 10초 타임아웃
-        }
+        # URL 해시는 캐시 키와 파일명에 함께 사용
+        url_hash = _url_hash(url)
+        loop = asyncio.get_running_loop()
+        try:
+            stream_url, ext = await loop.run_in_executor(_EXTRACT_POOL, resolve_stream_url, url, url_hash)
+        except HTTPException:
+            raise
+        except Exception as e:
+            # yt-dlp 추출 실패 (/extract와 동일하게 500)
+            logger.error("Stream URL extraction failed: %s", e)
+            raise HTTPException(status_code=500, detail=f"Video extraction failed: {str(e)}")
         
-        logger.info("Fast extracting with optimized yt-dlp...")
+        # 간단하고 안전한 파일명 생성 (ASCII만 사용, 같은 영상이면 같은 이름)
+        filename = f"video_{url_hash}.{ext}"
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            # 타임아웃 방지를 위한 빠른 추출
-            info = ydl.extract_info(url, download=False)
-            
-            # 스트리밍 가능한 URL 찾기
-            stream_url = None
-            if 'url' in info and info['url']:
-                stream_url = info['url']
-                logger.info(f"✅ Fast stream URL found: {stream_url[:50]}...")
-            
-            if not stream_url:
-                # 대안 URL 찾기
-                if 'formats' in info and info['formats']:
-                    for fmt in info['formats'][:3]:  # 처음 3개만 확인
-                        if fmt.get('url'):
-                            stream_url = fmt['url']
-                            logger.info(f"✅ Alternative stream URL found")
-                            break
-            
-            if not stream_url:
-                logger.error("❌ No streamable URL found")
-                raise HTTPException(status_code=404, detail="No streamable URL found for this video")
-            
-            # 간단하고 안전한 파일명 생성 (ASCII만 사용)
-            timestamp = int(time.time())
-            ext = info.get('ext', 'mp4')
-            filename = f"video_{timestamp}.{ext}"
-            
-            logger.info(f"✅ Generated safe filename: {filename}")
-            
-            # 302 리다이렉트로 실제 비디오 URL로 전달
-            response = RedirectResponse(url=stream_url, status_code=302)
-            response.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
-            response.headers["X-Railway-Status"] = "success"
-            
-            logger.info("✅ Fast redirect to stream URL completed")
-            return response
+        logger.info("Generated safe filename: %s", filename)
+        
+        # 본문을 디코딩하지 않고 그대로 중계하므로 압축되지 않은 응답을 요청
+        # Range 헤더를 전달하여 탐색(seek) 지원
+        upstream_headers = {"Accept-Encoding": "identity"}
+        range_header = request.headers.get("range")
+        if range_header:
+            upstream_headers["Range"] = range_header
+        
+        upstream_request = _HTTP.build_request("GET", stream_url, headers=upstream_headers)
+        upstream = await _HTTP.send(upstream_request, stream=True, follow_redirects=True)
+        
+        if upstream.status_code >= 400:
+            await upstream.aclose()
+            # 만료된 서명 URL일 수 있으므로 캐시에서 제거
+            with _CACHE_LOCK:
+                _STREAM_CACHE.pop(url_hash, None)
+            raise HTTPException(status_code=502, detail=f"Upstream returned {upstream.status_code}")
+        
+        headers = {
+            name: upstream.headers[name]
+            for name in _PASSTHROUGH_HEADERS
+            if name in upstream.headers
+        }
+        headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+        headers["X-Railway-Status"] = "success"
+        
+        # 업스트림 읽기와 클라이언트 쓰기를 겹쳐서 디스크 없이 일정한 메모리로 중계
+        logger.info("Proxying stream from upstream")
+        return StreamingResponse(
+            upstream.aiter_raw(chunk_size=_STREAM_CHUNK_SIZE),
+            status_code=upstream.status_code,
+            headers=headers,
+            media_type=upstream.headers.get("content-type", "video/mp4"),
+            background=BackgroundTask(upstream.aclose)
+        )
             
+    except HTTPException:
+        raise
+    except httpx.HTTPError as e:
+        logger.error("Upstream request failed: %s", e)
+        raise HTTPException(status_code=502, detail=f"Upstream request failed: {str(e)}")
+    # 다운로드 클라이언트가 오류 JSON을 영상 파일로 저장하지 않도록 항상 오류 상태 코드로 응답
     except UnicodeEncodeError as e:
-        logger.error(f"Unicode encoding error: {str(e)}")
-        return {"error": f"Character encoding error: {str(e)}"}
+        logger.error("Unicode encoding error: %s", e)
+        raise HTTPException(status_code=500, detail=f"Character encoding error: {str(e)}")
     except Exception as e:
-        logger.error(f"Streaming failed: {str(e)}")
-        return {"error": f"Streaming failed: {str(e)}"}
+        logger.error("Streaming failed: %s", e)
+        raise HTTPException(status_code=500, detail=f"Streaming failed: {str(e)}")
+
+@app.delete("/cache")
+async def clear_cache():
+    """메타데이터/스트림 URL 캐시 초기화
+
+    디스크/Redis 캐시는 모든 워커가 공유하지만, 메모리 캐시는 이 요청을 처리한
+    워커의 것만 비워진다. 다른 워커의 메모리 캐시는 TTL(최대 10분) 동안 유지된다.
+    """
+    with _CACHE_LOCK:
+        info_entries = len(_INFO_CACHE)
+        stream_entries = len(_STREAM_CACHE)
+        _INFO_CACHE.clear()
+        _STREAM_CACHE.clear()
+    # 파일/SQLite 정리는 블로킹 작업이므로 이벤트 루프 밖에서 실행
+    loop = asyncio.get_running_loop()
+    disk_entries = await loop.run_in_executor(_EXTRACT_POOL, _DCACHE.clear)
+    
+    redis_entries = 0
+    if _REDIS is not None:
+        try:
+            keys = [key async for key in _REDIS.scan_iter(match=_REDIS_KEY_PREFIX + "*", count=500)]
+            if keys:
+                redis_entries = await _REDIS.delete(*keys)
+        except RedisError as e:
+            _redis_failed("clear", e)
+    
+    logger.info(
+        "Cache cleared (%d info, %d stream, %d disk, %d redis)",
+        info_entries, stream_entries, disk_entries, redis_entries
+    )
+    return {
+        "success": True,
+        "cleared": {
+            "info": info_entries,
+            "stream": stream_entries,
+            "disk": disk_entries,
+            "redis": redis_entries
+        },
+        "memory_scope": "worker",
+        "message": "Shared disk/Redis caches cleared; in-memory caches cleared for this worker only"
+    }
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """캐시 상태 및 디스크 캐시 적중률 (적중/미스 수는 이 워커 기준)"""
+    loop = asyncio.get_running_loop()
+    disk_entries, disk_volume = await loop.run_in_executor(
+        _EXTRACT_POOL, lambda: (len(_DCACHE), _DCACHE.volume())
+    )
+    with _CACHE_LOCK:
+        info_entries = len(_INFO_CACHE)
+        stream_entries = len(_STREAM_CACHE)
+        hits, misses = _DCACHE_COUNTS["hits"], _DCACHE_COUNTS["misses"]
+    
+    return {
+        "memory": {
+            "info": info_entries,
+            "stream": stream_entries
+        },
+        "disk": {
+            "entries": disk_entries,
+            "volume": disk_volume,
+            "hits": hits,
+            "misses": misses
+        }
+    }
 
 @app.post("/download")
 async def prepare_download(request: VideoRequest):
@@ -314,8 +781,7 @@ async def prepare_download(request: VideoRequest):
     try:
         url = str(request.url)
         # Railway 서버를 통한 프록시 다운로드 URL 생성
-        base_url = "https://railway-ytdlp-fresh-railway-ytdlp-fresh.up.railway.app"
-        proxy_url = f"{base_url}/stream?url={url}"
+        proxy_url = _PROXY_STREAM_PREFIX + url
         
         return {
             "success": True,
@@ -326,7 +792,7 @@ async def prepare_download(request: VideoRequest):
         }
         
     except Exception as e:
-        logger.error(f"Download preparation failed: {str(e)}")
+        logger.error("Download preparation failed: %s", e)
         return {
             "success": False,
             "error": str(e),
@@ -335,15 +801,22 @@ async def prepare_download(request: VideoRequest):
 
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 8080))
+    # 캐시, YoutubeDL 풀, 추출 프로세스 풀은 워커 프로세스별로 따로 유지됨
+    # 프로덕션 대안: gunicorn -k uvicorn.workers.UvicornWorker -w $WEB_CONCURRENCY main:app
+    workers = _WEB_CONCURRENCY
     
-    logger.info(f"🚀 Railway yt-dlp API Server (Fresh Deploy) 시작")
-    logger.info(f"📡 포트: {port}")
-    logger.info(f"🎬 yt-dlp 상태: {'Available' if YT_DLP_AVAILABLE else 'Mock Mode'}")
+    logger.info("🚀 Railway yt-dlp API Server (Fresh Deploy) 시작")
+    logger.info("📡 포트: %d", port)
+    logger.info("👷 워커: %d", workers)
+    logger.info("🎬 yt-dlp 상태: %s", "Available" if YT_DLP_AVAILABLE else "Mock Mode")
     
     uvicorn.run(
-        app,
+        "main:app",
         host="0.0.0.0", 
         port=port,
+        workers=workers,
+        loop="uvloop",
+        http="httptools",
         reload=False,
-        access_log=True
+        access_log=os.getenv("ACCESS_LOG") == "1"
     )
\ No newline at end of file